@@ -9,8 +9,8 @@
 #include "q_swarm_controller.h"
 #include <argos3/core/utility/configuration/argos_configuration.h>
 #include <argos3/core/utility/logging/argos_log.h>
-#include <sstream>
 #include <cmath>
+#include <cstring>
 #include <algorithm>
 
 namespace argos {
@@ -236,34 +236,29 @@ namespace argos {
          return rand() % 4;
       }
 
-      // Build state message: "STATE|robot_id|x|y|goal_x|goal_y|prox0|...|prox23"
-      std::ostringstream oss;
-      oss << "STATE|" << m_nRobotIdNum;
-      for (float val : state) {
-         oss << "|" << val;
-      }
+      // Build state frame: uint8 type | uint32 robot_id | 28 x float32 state
+      // (little-endian, matching the host byte order on x86/ARM)
+      unsigned char frame[STATE_FRAME_SIZE] = {0};
+      uint32_t robotId = static_cast<uint32_t>(m_nRobotIdNum);
+      size_t count = std::min(state.size(), static_cast<size_t>(STATE_SIZE));
+      frame[0] = MSG_STATE;
+      std::memcpy(frame + 1, &robotId, sizeof(robotId));
+      std::memcpy(frame + 1 + sizeof(robotId), state.data(), count * sizeof(float));
 
       // Send state
-      if (!SendMessage(oss.str())) {
+      if (!SendFrame(frame, sizeof(frame))) {
          LOGERR << "[Robot " << m_strRobotId << "] Failed to send state" << std::endl;
          return 0;  // Default action: move forward
       }
 
-      // Receive action: "ACTION|action_id"
-      std::string response = ReceiveMessage();
-      if (response.empty()) {
+      // Receive action frame: uint8 type | uint8 action_id
+      unsigned char response[ACTION_FRAME_SIZE];
+      if (!ReceiveFrame(response, sizeof(response)) || response[0] != MSG_ACTION) {
          LOGERR << "[Robot " << m_strRobotId << "] No response from Q-Network" << std::endl;
          return 0;
       }
 
-      // Parse action
-      size_t pos = response.find('|');
-      if (pos != std::string::npos) {
-         std::string actionStr = response.substr(pos + 1);
-         return std::stoi(actionStr);
-      }
-
-      return 0;  // Default action
+      return response[1];
    }
 
    /****************************************/
@@ -368,14 +363,19 @@ namespace argos {
    void QSwarmController::SendReward(float reward, bool done) {
       if (!m_bConnected) return;
 
-      // Build reward message: "REWARD|robot_id|reward|done"
-      std::ostringstream oss;
-      oss << "REWARD|" << m_nRobotIdNum << "|" << reward << "|" << (done ? "1" : "0");
+      // Build reward frame: uint8 type | uint32 robot_id | float32 reward | uint8 done
+      unsigned char frame[REWARD_FRAME_SIZE];
+      uint32_t robotId = static_cast<uint32_t>(m_nRobotIdNum);
+      frame[0] = MSG_REWARD;
+      std::memcpy(frame + 1, &robotId, sizeof(robotId));
+      std::memcpy(frame + 1 + sizeof(robotId), &reward, sizeof(reward));
+      frame[REWARD_FRAME_SIZE - 1] = done ? 1 : 0;
 
-      SendMessage(oss.str());
+      SendFrame(frame, sizeof(frame));
 
       // Wait for acknowledgment
-      ReceiveMessage();
+      unsigned char ack[ACK_FRAME_SIZE];
+      ReceiveFrame(ack, sizeof(ack));
    }
 
    /****************************************/
@@ -402,37 +402,36 @@ namespace argos {
    /****************************************/
    /****************************************/
 
-   bool QSwarmController::SendMessage(const std::string& message) {
+   bool QSwarmController::SendFrame(const unsigned char* frame, size_t size) {
       if (m_nSocket < 0 || !m_bConnected) return false;
 
-      std::string msg = message + "\n";  // Add newline delimiter
-      int sent = send(m_nSocket, msg.c_str(), msg.length(), 0);
-      
-      return sent > 0;
+      size_t total = 0;
+      while (total < size) {
+         int sent = send(m_nSocket, reinterpret_cast<const char*>(frame) + total,
+                         static_cast<int>(size - total), 0);
+         if (sent <= 0) return false;
+         total += sent;
+      }
+
+      return true;
    }
 
    /****************************************/
    /****************************************/
 
-   std::string QSwarmController::ReceiveMessage() {
-      if (m_nSocket < 0 || !m_bConnected) return "";
+   bool QSwarmController::ReceiveFrame(unsigned char* frame, size_t size) {
+      if (m_nSocket < 0 || !m_bConnected) return false;
 
-      char buffer[4096];
-      int received = recv(m_nSocket, buffer, sizeof(buffer) - 1, 0);
-      
-      if (received > 0) {
-         buffer[received] = '\0';
-         std::string msg(buffer);
-         
-         // Remove newline if present
-         if (!msg.empty() && msg.back() == '\n') {
-            msg.pop_back();
-         }
-         
-         return msg;
+      // TCP has no message boundaries: read until the whole frame arrived
+      size_t total = 0;
+      while (total < size) {
+         int received = recv(m_nSocket, reinterpret_cast<char*>(frame) + total,
+                             static_cast<int>(size - total), 0);
+         if (received <= 0) return false;
+         total += received;
       }
 
-      return "";
+      return true;
    }
 
    /****************************************/
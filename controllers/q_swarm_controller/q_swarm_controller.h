@@ -19,6 +19,7 @@
 #include <string>
 #include <vector>
 #include <memory>
+#include <cstdint>
 
 // For socket communication
 #ifdef _WIN32
@@ -34,6 +35,20 @@
 
 namespace argos {
 
+   /*
+    * Binary protocol shared with python/q_server.py
+    * (little-endian, fixed-size frames)
+    */
+   const int STATE_SIZE = 28;                          // 4 (position + goal) + 24 (proximity)
+   const unsigned char MSG_STATE = 0x01;
+   const unsigned char MSG_REWARD = 0x02;
+   const unsigned char MSG_ACTION = 0x03;
+   const unsigned char MSG_ACK = 0x04;
+   const size_t STATE_FRAME_SIZE = 1 + 4 + 4 * STATE_SIZE;  // type | robot_id | state
+   const size_t REWARD_FRAME_SIZE = 1 + 4 + 4 + 1;          // type | robot_id | reward | done
+   const size_t ACTION_FRAME_SIZE = 1 + 1;                  // type | action_id
+   const size_t ACK_FRAME_SIZE = 1;                         // type
+
    class QSwarmController : public CCI_Controller {
 
    public:
@@ -176,14 +191,14 @@ namespace argos {
       void ResetEpisode();
 
       /*
-       * Send message through socket
+       * Send a complete binary frame through socket
        */
-      bool SendMessage(const std::string& message);
+      bool SendFrame(const unsigned char* frame, size_t size);
 
       /*
-       * Receive message from socket
+       * Receive exactly one binary frame of the given size from socket
        */
-      std::string ReceiveMessage();
+      bool ReceiveFrame(unsigned char* frame, size_t size);
 
       /*
        * Close socket connection
@@ -13,8 +13,9 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 import numpy as np
-import random
-from collections import deque
+import contextlib
+import copy
+import warnings
 import os
 
 
@@ -25,9 +26,12 @@ class DQN(nn.Module):
     Input: State vector [x, y, goal_x, goal_y, prox_0, ..., prox_23]
            Total size: 4 + 24 = 28
     Output: Q-values for 4 actions [forward, left, right, stop]
+    
+    With layer_norm=True each hidden layer is normalized, which keeps
+    bootstrapped targets stable when training without a target network.
     """
     
-    def __init__(self, state_size=28, action_size=4, hidden_size=128):
+    def __init__(self, state_size=28, action_size=4, hidden_size=128, layer_norm=False):
         super(DQN, self).__init__()
         
         self.fc1 = nn.Linear(state_size, hidden_size)
@@ -35,35 +39,150 @@ class DQN(nn.Module):
         self.fc3 = nn.Linear(hidden_size, hidden_size)
         self.fc4 = nn.Linear(hidden_size, action_size)
         
+        norm = nn.LayerNorm if layer_norm else (lambda size: nn.Identity())
+        self.norm1 = norm(hidden_size)
+        self.norm2 = norm(hidden_size)
+        self.norm3 = norm(hidden_size)
+        
         self.relu = nn.ReLU()
         
     def forward(self, x):
-        x = self.relu(self.fc1(x))
-        x = self.relu(self.fc2(x))
-        x = self.relu(self.fc3(x))
+        x = self.relu(self.norm1(self.fc1(x)))
+        x = self.relu(self.norm2(self.fc2(x)))
+        x = self.relu(self.norm3(self.fc3(x)))
         x = self.fc4(x)
         return x
 
 
+@contextlib.contextmanager
+def _quiet_torchscript():
+    """Hide the deprecation FutureWarning newer torch emits for TorchScript calls"""
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message=r"`torch\.jit\.", category=FutureWarning)
+        yield
+
+
+def bellman_target(rewards: torch.Tensor, dones: torch.Tensor,
+                   next_q_all: torch.Tensor, gamma: float) -> torch.Tensor:
+    """
+    Compute the Bellman target r + (1 - done) * gamma * max_a Q(s', a)
+    
+    Scripted so the pointwise ops are fused into a single kernel.
+    """
+    next_q = next_q_all.max(dim=1).values
+    return rewards + (1.0 - dones) * gamma * next_q
+
+
+with _quiet_torchscript():
+    bellman_target = torch.jit.script(bellman_target)
+
+
 class ReplayBuffer:
     """
     Experience Replay Buffer
     
     Stores transitions (state, action, reward, next_state, done)
-    for training the Q-Network
+    for training the Q-Network.
+    
+    Transitions are kept in preallocated tensors (one per field) on the
+    training device and written in place using ring-buffer indexing, so
+    sampling returns already-batched tensors with no host-to-device copy.
     """
     
-    def __init__(self, capacity=10000):
-        self.buffer = deque(maxlen=capacity)
+    def __init__(self, capacity=10000, state_size=28, device="cpu"):
+        self.capacity = capacity
+        self.state_size = state_size
+        self.device = torch.device(device)
+        
+        self.states = torch.empty((capacity, state_size), dtype=torch.float32, device=self.device)
+        self.actions = torch.empty(capacity, dtype=torch.int64, device=self.device)
+        self.rewards = torch.empty(capacity, dtype=torch.float32, device=self.device)
+        self.next_states = torch.empty((capacity, state_size), dtype=torch.float32, device=self.device)
+        self.dones = torch.empty(capacity, dtype=torch.float32, device=self.device)
+        
+        self._on_cpu = self.device.type == 'cpu'
+        if self._on_cpu:
+            # NumPy views share memory with the tensors; writing through
+            # them skips the per-element torch dispatch on every push
+            self._states_np = self.states.numpy()
+            self._actions_np = self.actions.numpy()
+            self._rewards_np = self.rewards.numpy()
+            self._next_states_np = self.next_states.numpy()
+            self._dones_np = self.dones.numpy()
+        else:
+            # Host staging row: state | next_state | reward | done | action,
+            # sent to the device in one copy per transition
+            self._row = np.empty(2 * state_size + 3, dtype=np.float32)
+        
+        # Next write position and number of stored transitions
+        self.pos = 0
+        self.size = 0
     
     def push(self, state, action, reward, next_state, done):
-        self.buffer.append((state, action, reward, next_state, done))
+        pos = self.pos
+        if self._on_cpu:
+            self._states_np[pos] = state
+            self._actions_np[pos] = action
+            self._rewards_np[pos] = reward
+            self._next_states_np[pos] = next_state
+            self._dones_np[pos] = done
+        else:
+            n = self.state_size
+            row = self._row
+            row[:n] = state
+            row[n:2 * n] = next_state
+            row[2 * n:] = (reward, done, action)
+            
+            # Synchronous copy, so the staging row can be reused right away
+            row = torch.from_numpy(row).to(self.device)
+            self.states[pos] = row[:n]
+            self.next_states[pos] = row[n:2 * n]
+            self.rewards[pos] = row[2 * n]
+            self.dones[pos] = row[2 * n + 1]
+            self.actions[pos] = row[2 * n + 2]
+        
+        self.pos = (self.pos + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
     
     def sample(self, batch_size):
-        return random.sample(self.buffer, batch_size)
+        """
+        Sample a batch of transitions
+        
+        Returns:
+            Tuple of stacked tensors (states, actions, rewards, next_states, dones);
+            states/next_states are (batch_size, state_size), the rest (batch_size,)
+        """
+        idx = torch.randint(0, self.size, (batch_size,), device=self.device)
+        return (self.states[idx],
+                self.actions[idx],
+                self.rewards[idx],
+                self.next_states[idx],
+                self.dones[idx])
     
     def __len__(self):
-        return len(self.buffer)
+        return self.size
+
+
+def checkpoint_options(checkpoint):
+    """
+    Network options a checkpoint was saved with
+    
+    Args:
+        checkpoint: Checkpoint dict or path to a saved checkpoint
+        
+    Returns:
+        Dict with 'layer_norm' and 'use_target_network'; checkpoints
+        that don't record them get values inferred from their weights
+    """
+    if isinstance(checkpoint, (str, os.PathLike)):
+        checkpoint = torch.load(checkpoint, map_location="cpu")
+    
+    return {
+        'layer_norm': checkpoint.get(
+            'layer_norm', 'norm1.weight' in checkpoint['q_network_state_dict']),
+        'use_target_network': checkpoint.get(
+            'use_target_network', 'target_network_state_dict' in checkpoint),
+    }
 
 
 class QNetworkAgent:
@@ -75,50 +194,160 @@ class QNetworkAgent:
     """
     
     def __init__(self, state_size=28, action_size=4, learning_rate=0.001,
-                 gamma=0.99, epsilon=1.0, epsilon_min=0.01, epsilon_decay=0.995):
+                 gamma=0.99, epsilon=1.0, epsilon_min=0.01, epsilon_decay=0.995,
+                 compile_network=True, num_robots=4, use_target_network=True,
+                 layer_norm=False, quantize_inference=False):
         
         self.state_size = state_size
         self.action_size = action_size
+        self.num_robots = num_robots
         self.gamma = gamma  # Discount factor
         self.epsilon = epsilon  # Exploration rate
         self.epsilon_min = epsilon_min
         self.epsilon_decay = epsilon_decay
         self.learning_rate = learning_rate
+        self.use_target_network = use_target_network
+        self.layer_norm = layer_norm
+        self.quantize_inference = quantize_inference
+        
+        # Random generator for exploration
+        self.rng = np.random.default_rng()
         
         # Device (CPU or GPU)
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         print(f"Using device: {self.device}")
         
-        # Q-Network and Target Network
-        self.q_network = DQN(state_size, action_size).to(self.device)
-        self.target_network = DQN(state_size, action_size).to(self.device)
-        self.target_network.load_state_dict(self.q_network.state_dict())
-        self.target_network.eval()
+        # Q-Network and Target Network (without a target network the
+        # Q-network bootstraps its own targets, PQN-style, which needs
+        # layer_norm=True to stay stable)
+        if not use_target_network and not layer_norm:
+            print("[WARNING] Training without a target network is unstable "
+                  "unless layer_norm=True")
+        self.q_network = DQN(state_size, action_size,
+                             layer_norm=layer_norm).to(self.device)
+        self.target_network = None
+        if use_target_network:
+            self.target_network = DQN(state_size, action_size,
+                                      layer_norm=layer_norm).to(self.device)
+            self.target_network.load_state_dict(self.q_network.state_dict())
+            self.target_network.eval()
+            
+            # Tensors copied on each target network sync (kept on device)
+            self._q_tensors = (list(self.q_network.parameters())
+                               + list(self.q_network.buffers()))
+            self._target_tensors = (list(self.target_network.parameters())
+                                    + list(self.target_network.buffers()))
+        
+        # Mixed precision on CUDA (bfloat16 where supported, else float16)
+        self.use_amp = self.device.type == 'cuda'
+        self.amp_dtype = torch.float16
+        if self.use_amp and torch.cuda.is_bf16_supported():
+            self.amp_dtype = torch.bfloat16
         
-        # Optimizer
-        self.optimizer = optim.Adam(self.q_network.parameters(), lr=learning_rate)
+        # Loss scaling is only needed for float16: bfloat16 has float32's
+        # range, and an enabled scaler reads found_inf back every step
+        use_scaler = self.use_amp and self.amp_dtype == torch.float16
+        if hasattr(torch.amp, 'GradScaler'):
+            self.scaler = torch.amp.GradScaler('cuda', enabled=use_scaler)
+        else:
+            self.scaler = torch.cuda.amp.GradScaler(enabled=use_scaler)  # torch < 2.3
+        
+        # Optimizer (single fused kernel on CUDA, multi-tensor otherwise)
+        if self.device.type == 'cuda':
+            self.optimizer = optim.Adam(self.q_network.parameters(), lr=learning_rate,
+                                        fused=True)
+        else:
+            self.optimizer = optim.Adam(self.q_network.parameters(), lr=learning_rate,
+                                        foreach=True)
         
         # Loss function
         self.criterion = nn.MSELoss()
         
         # Replay buffer
-        self.replay_buffer = ReplayBuffer(capacity=10000)
+        self.replay_buffer = ReplayBuffer(capacity=10000, state_size=state_size,
+                                          device=self.device)
         
         # Batch size for training
         self.batch_size = 64
         
+        # Compiled forward passes (parameters are shared with the modules);
+        # action selection gets its own inference-only variant
+        self._q_forward = self.q_network
+        self._infer_forward = self.q_network
+        if compile_network:
+            warmup_shapes = [(self.batch_size, torch.enable_grad)]
+            if not use_target_network:
+                warmup_shapes.append((self.batch_size, torch.no_grad))
+            self._q_forward = self._compile_network(self.q_network, warmup_shapes)
+        if compile_network:
+            self._infer_forward = self._compile_network(
+                self.q_network, [(1, torch.inference_mode), (num_robots, torch.inference_mode)],
+                inference=True)
+        
+        self._target_forward = self._q_forward
+        if use_target_network:
+            self._target_forward = self.target_network
+            if compile_network:
+                self._target_forward = self._compile_network(
+                    self.target_network, [(self.batch_size, torch.no_grad)])
+        
         # Target network update frequency
         self.target_update_freq = 100
         self.update_counter = 0
         
-        # Current state for each robot
-        self.current_states = {}
-        self.current_actions = {}
+        # Reduced-precision copy for action selection (refreshed periodically)
+        if quantize_inference:
+            self.refresh_inference_network()
+        
+        # Current state and action for each robot (indexed by robot_id)
+        self.current_states = np.zeros((num_robots, state_size), dtype=np.float32)
+        self.current_actions = np.zeros(num_robots, dtype=np.int64)
         
         # Statistics
         self.episode_rewards = []
         self.losses = []
         
+    def _compile_network(self, network, warmup_shapes, inference=False):
+        """
+        Compile a network's forward pass to cut per-call Python overhead
+        
+        Uses torch.compile on CUDA and TorchScript on CPU, then runs a
+        warmup pass for each (batch_size, grad_mode) pair so the
+        compiled variants exist before the first real call. On CUDA the
+        whole forward is compiled as one static-shape graph with autotuned
+        kernels and CUDA graph replay, one variant per warmed-up shape.
+        With inference=True the TorchScript module is frozen, which inlines
+        submodules and lets it run under inference_mode (frozen parameters
+        still alias the live weights, so training updates are visible).
+        Falls back to the eager module if compilation is unavailable or fails.
+        """
+        try:
+            if self.device.type == 'cuda':
+                compiled = torch.compile(network, fullgraph=True, mode="max-autotune",
+                                         dynamic=False)
+            else:
+                with _quiet_torchscript():
+                    compiled = torch.jit.script(network)
+                    if inference:
+                        compiled = torch.jit.freeze(compiled.eval())
+            
+            for batch_size, grad_mode in warmup_shapes:
+                warmup = torch.zeros(batch_size, self.state_size, device=self.device)
+                with grad_mode(), self._autocast():
+                    compiled(warmup)
+            
+            return compiled
+        
+        except Exception as e:
+            print(f"[WARNING] Network compilation failed, using eager mode: {e}")
+            return network
+    
+    def _autocast(self):
+        """Autocast context for forward passes (no-op when AMP is disabled)"""
+        return torch.autocast(device_type=self.device.type, dtype=self.amp_dtype,
+                              enabled=self.use_amp)
+    
+    @torch.inference_mode()
     def select_action(self, state, robot_id):
         """
         Select action using epsilon-greedy policy
@@ -130,18 +359,19 @@ class QNetworkAgent:
         Returns:
             action: Selected action (0-3)
         """
-        # Store current state
+        # Store current state (float32 up front, no copy if already ndarray)
+        state = np.asarray(state, dtype=np.float32)
         self.current_states[robot_id] = state
         
         # Epsilon-greedy action selection
-        if np.random.rand() < self.epsilon:
+        if self.rng.random() < self.epsilon:
             # Explore: random action
-            action = np.random.randint(0, self.action_size)
+            action = int(self.rng.integers(0, self.action_size))
         else:
             # Exploit: best action from Q-network
-            state_tensor = torch.FloatTensor(state).unsqueeze(0).to(self.device)
-            with torch.no_grad():
-                q_values = self.q_network(state_tensor)
+            state_tensor = torch.from_numpy(state).unsqueeze(0).to(self.device)
+            with self._autocast():
+                q_values = self._infer_forward(state_tensor)
             action = q_values.argmax().item()
         
         # Store current action
@@ -149,6 +379,37 @@ class QNetworkAgent:
         
         return action
     
+    @torch.inference_mode()
+    def select_actions_batch(self, states, robot_ids):
+        """
+        Select actions for several robots with a single forward pass
+        
+        Args:
+            states: Array of state vectors, shape (n, state_size)
+            robot_ids: IDs of the robots, one per state
+            
+        Returns:
+            actions: Array of selected actions (0-3), one per robot
+        """
+        states = np.asarray(states, dtype=np.float32)
+        n = len(states)
+        
+        # Exploit: best actions from Q-network for the whole batch
+        state_tensor = torch.from_numpy(states).to(self.device)
+        with self._autocast():
+            q_values = self._infer_forward(state_tensor)
+        greedy = q_values.argmax(1).cpu().numpy()
+        
+        # Explore: per-row epsilon-greedy replacement with random actions
+        explore = self.rng.random(n) < self.epsilon
+        actions = np.where(explore, self.rng.integers(0, self.action_size, n), greedy)
+        
+        # Store current state and action for each robot
+        self.current_states[robot_ids] = states
+        self.current_actions[robot_ids] = actions
+        
+        return actions
+    
     def store_transition(self, robot_id, reward, next_state, done):
         """
         Store transition in replay buffer
@@ -159,11 +420,10 @@ class QNetworkAgent:
             next_state: Next state after action
             done: Whether episode is done
         """
-        if robot_id in self.current_states and robot_id in self.current_actions:
-            state = self.current_states[robot_id]
-            action = self.current_actions[robot_id]
-            
-            self.replay_buffer.push(state, action, reward, next_state, done)
+        state = self.current_states[robot_id]
+        action = self.current_actions[robot_id]
+        
+        self.replay_buffer.push(state, action, reward, next_state, done)
     
     def train(self):
         """
@@ -176,39 +436,24 @@ class QNetworkAgent:
         if len(self.replay_buffer) < self.batch_size:
             return None
         
-        # Sample batch from replay buffer
+        # Sample batch from replay buffer (already stacked, on device)
         batch = self.replay_buffer.sample(self.batch_size)
         
-        # Unpack batch
-        states, actions, rewards, next_states, dones = zip(*batch)
-        
-        # Convert to tensors
-        states = torch.FloatTensor(np.array(states)).to(self.device)
-        actions = torch.LongTensor(actions).to(self.device)
-        rewards = torch.FloatTensor(rewards).to(self.device)
-        next_states = torch.FloatTensor(np.array(next_states)).to(self.device)
-        dones = torch.FloatTensor(dones).to(self.device)
+        loss = self._compute_loss(self._q_forward, self._target_forward, batch)
         
-        # Current Q-values
-        current_q_values = self.q_network(states).gather(1, actions.unsqueeze(1))
+        # Optimize (gradient scaling is a no-op unless float16 autocast is on)
+        self.optimizer.zero_grad(set_to_none=True)
+        self.scaler.scale(loss).backward()
+        self.scaler.step(self.optimizer)
+        self.scaler.update()
         
-        # Next Q-values from target network
-        with torch.no_grad():
-            next_q_values = self.target_network(next_states).max(1)[0]
-            target_q_values = rewards + (1 - dones) * self.gamma * next_q_values
-        
-        # Compute loss
-        loss = self.criterion(current_q_values.squeeze(), target_q_values)
-        
-        # Optimize
-        self.optimizer.zero_grad()
-        loss.backward()
-        self.optimizer.step()
-        
-        # Update target network periodically
+        # Update target network (and reduced-precision inference copy) periodically
         self.update_counter += 1
         if self.update_counter % self.target_update_freq == 0:
-            self.target_network.load_state_dict(self.q_network.state_dict())
+            if self.use_target_network:
+                self.update_target_network()
+            if self.quantize_inference:
+                self.refresh_inference_network()
         
         # Decay epsilon
         if self.epsilon > self.epsilon_min:
@@ -216,26 +461,90 @@ class QNetworkAgent:
         
         return loss.item()
     
+    def _compute_loss(self, q_forward, target_forward, batch):
+        """Compute the TD loss for a batch of transitions"""
+        states, actions, rewards, next_states, dones = batch
+        
+        with self._autocast():
+            # Current Q-values
+            current_q_values = q_forward(states).gather(1, actions.unsqueeze(1))
+            
+            # Next Q-values from target network
+            with torch.no_grad():
+                target_q_values = bellman_target(
+                    rewards, dones, target_forward(next_states), self.gamma)
+            
+            # Compute loss (autocast runs MSE in float32)
+            return self.criterion(current_q_values.squeeze(), target_q_values)
+    
+    def update_target_network(self):
+        """Copy Q-network weights into the target network in place"""
+        with torch.no_grad():
+            if hasattr(torch, '_foreach_copy_'):
+                torch._foreach_copy_(self._target_tensors, self._q_tensors)
+            else:
+                for target, source in zip(self._target_tensors, self._q_tensors):
+                    target.copy_(source)
+    
+    def refresh_inference_network(self):
+        """
+        Rebuild the reduced-precision network used for action selection
+        
+        On CPU the Q-network's Linear layers are dynamically quantized to
+        int8; on CUDA a copy is cast to the autocast dtype. The copy is a
+        snapshot, so it lags training by up to target_update_freq steps.
+        """
+        network = copy.deepcopy(self.q_network).eval()
+        
+        if self.device.type == 'cuda':
+            self._infer_forward = network.to(self.amp_dtype)
+            return
+        
+        try:
+            self._infer_forward = torch.ao.quantization.quantize_dynamic(
+                network, {nn.Linear}, dtype=torch.qint8)
+        except Exception as e:
+            print(f"[WARNING] Quantization failed, using float inference: {e}")
+            self.quantize_inference = False
+    
     def save_model(self, filepath):
         """Save model weights"""
-        torch.save({
+        checkpoint = {
             'q_network_state_dict': self.q_network.state_dict(),
-            'target_network_state_dict': self.target_network.state_dict(),
             'optimizer_state_dict': self.optimizer.state_dict(),
             'epsilon': self.epsilon,
             'episode_rewards': self.episode_rewards,
-        }, filepath)
+            'layer_norm': self.layer_norm,
+            'use_target_network': self.use_target_network,
+        }
+        if self.use_target_network:
+            checkpoint['target_network_state_dict'] = self.target_network.state_dict()
+        torch.save(checkpoint, filepath)
         print(f"Model saved to {filepath}")
     
     def load_model(self, filepath):
         """Load model weights"""
         if os.path.exists(filepath):
             checkpoint = torch.load(filepath)
+            
+            # The network layout depends on layer_norm
+            layer_norm = checkpoint_options(checkpoint)['layer_norm']
+            if layer_norm != self.layer_norm:
+                raise ValueError(
+                    f"Checkpoint {filepath} was saved with layer_norm={layer_norm}, "
+                    f"but the agent was created with layer_norm={self.layer_norm}")
+            
             self.q_network.load_state_dict(checkpoint['q_network_state_dict'])
-            self.target_network.load_state_dict(checkpoint['target_network_state_dict'])
+            if self.use_target_network:
+                if 'target_network_state_dict' in checkpoint:
+                    self.target_network.load_state_dict(checkpoint['target_network_state_dict'])
+                else:
+                    self.update_target_network()
             self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
             self.epsilon = checkpoint['epsilon']
             self.episode_rewards = checkpoint['episode_rewards']
+            if self.quantize_inference:
+                self.refresh_inference_network()
             print(f"Model loaded from {filepath}")
         else:
             print(f"No model found at {filepath}")
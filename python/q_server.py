@@ -5,54 +5,260 @@ This script runs a socket server that communicates with the ARGoS
 C++ controllers. It receives states, selects actions using the Q-Network,
 and performs learning updates based on rewards.
 
-Protocol:
+Protocol (binary, little-endian fixed-size frames):
+- Receive STATE:  uint8 0x01 | uint32 robot_id | 28 x float32 state
+- Send ACTION:    uint8 0x03 | uint8 action_id
+- Receive REWARD: uint8 0x02 | uint32 robot_id | float32 reward | uint8 done
+- Send ACK:       uint8 0x04
+
+Legacy text controllers are still supported and detected from the
+first byte of the connection:
 - Receive: "STATE|robot_id|x|y|goal_x|goal_y|prox0|...|prox23"
 - Send: "ACTION|action_id"
 - Receive: "REWARD|robot_id|reward|done"
 - Send: "ACK"
 """
 
+import selectors
+import shutil
 import socket
-import threading
+import struct
 import time
 import numpy as np
 import os
 from q_network import QNetworkAgent
 
 
+# Number of FootBots in the experiment (robot IDs 0..NUM_ROBOTS-1)
+NUM_ROBOTS = 4
+
+# State vector size: 4 (position + goal) + 24 (proximity sensors)
+STATE_SIZE = 28
+
+# Binary frame message types
+MSG_STATE = 0x01
+MSG_REWARD = 0x02
+MSG_ACTION = 0x03
+MSG_ACK = 0x04
+
+# Binary frame layouts
+STATE_FRAME = struct.Struct(f'<BI{STATE_SIZE}f')
+REWARD_FRAME = struct.Struct('<BIfB')
+ACTION_FRAME = struct.Struct('<BB')
+ACK_FRAME = struct.Struct('<B')
+ROBOT_ID = struct.Struct('<I')
+
+
+class BinaryConnection:
+    """
+    Client connection speaking the binary frame protocol
+    
+    Data is received into one preallocated buffer per client and parsed
+    in place; only the 28-float state vector is copied out.
+    """
+    
+    def __init__(self, client_socket):
+        self.socket = client_socket
+        self.buffer = bytearray(8192)
+        self.view = memoryview(self.buffer)
+        self.filled = 0  # Bytes received into the buffer
+        self.offset = 0  # Start of the first unparsed frame
+    
+    def receive(self):
+        """Receive available data; returns False if the client disconnected"""
+        # Move any partial frame to the start of the buffer
+        if self.offset:
+            remaining = self.filled - self.offset
+            self.buffer[:remaining] = self.buffer[self.offset:self.filled]
+            self.filled = remaining
+            self.offset = 0
+        
+        received = self.socket.recv_into(self.view[self.filled:])
+        self.filled += received
+        return received > 0
+    
+    def next_message(self, states_only=False):
+        """
+        Parse the next complete frame
+        
+        Args:
+            states_only: Leave any non-STATE frame unparsed
+            
+        Returns:
+            (MSG_STATE, robot_id, state) or (MSG_REWARD, robot_id, reward, done),
+            or None if no (matching) complete frame is available
+        """
+        available = self.filled - self.offset
+        if available == 0:
+            return None
+        
+        msg_type = self.buffer[self.offset]
+        
+        if msg_type == MSG_STATE:
+            if available < STATE_FRAME.size:
+                return None
+            
+            robot_id, = ROBOT_ID.unpack_from(self.buffer, self.offset + 1)
+            state = np.frombuffer(self.buffer, dtype='<f4', count=STATE_SIZE,
+                                  offset=self.offset + 1 + ROBOT_ID.size)
+            self.offset += STATE_FRAME.size
+            
+            # Copy out of the receive buffer, which is reused
+            return MSG_STATE, robot_id, state.astype(np.float32)
+        
+        if states_only:
+            return None
+        
+        if msg_type == MSG_REWARD:
+            if available < REWARD_FRAME.size:
+                return None
+            
+            _, robot_id, reward, done = REWARD_FRAME.unpack_from(self.buffer, self.offset)
+            self.offset += REWARD_FRAME.size
+            return MSG_REWARD, robot_id, reward, done == 1
+        
+        raise ValueError(f"Unknown frame type: {msg_type}")
+    
+    def send_action(self, action):
+        self.socket.sendall(ACTION_FRAME.pack(MSG_ACTION, action))
+    
+    def send_ack(self):
+        self.socket.sendall(ACK_FRAME.pack(MSG_ACK))
+
+
+class TextConnection:
+    """Client connection speaking the legacy text protocol"""
+    
+    def __init__(self, client_socket):
+        self.socket = client_socket
+        self.pending = ""
+        self.messages = []
+    
+    def receive(self):
+        """Receive available data; returns False if the client disconnected"""
+        data = self.socket.recv(4096)
+        
+        if not data:
+            return False
+        
+        # Split into complete newline-terminated messages
+        self.pending += data.decode('utf-8')
+        *messages, self.pending = self.pending.split('\n')
+        self.messages.extend(m.strip() for m in messages if m.strip())
+        return True
+    
+    def next_message(self, states_only=False):
+        """
+        Parse the next complete message
+        
+        Malformed messages are answered with a default reply and skipped.
+        
+        Args:
+            states_only: Leave any non-STATE message unparsed
+            
+        Returns:
+            (MSG_STATE, robot_id, state) or (MSG_REWARD, robot_id, reward, done),
+            or None if no (matching) complete message is available
+        """
+        while self.messages:
+            parts = self.messages[0].split('|')
+            msg_type = parts[0]
+            
+            if states_only and msg_type != "STATE":
+                return None
+            
+            self.messages.pop(0)
+            
+            if msg_type == "STATE":
+                # Format: STATE|robot_id|x|y|goal_x|goal_y|prox0|...|prox23
+                # Verify state size
+                if len(parts) != 2 + STATE_SIZE:
+                    print(f"[WARNING] Invalid state size: {len(parts) - 2} (expected {STATE_SIZE})")
+                    self.send_action(0)  # Default: move forward
+                    continue
+                
+                try:
+                    robot_id = int(parts[1])
+                    state_values = np.fromiter(map(float, parts[2:]), dtype=np.float32,
+                                               count=STATE_SIZE)
+                except Exception as e:
+                    print(f"[ERROR] Error handling state: {e}")
+                    self.send_action(0)
+                    continue
+                
+                return MSG_STATE, robot_id, state_values
+            
+            elif msg_type == "REWARD":
+                # Format: REWARD|robot_id|reward|done
+                try:
+                    return MSG_REWARD, int(parts[1]), float(parts[2]), int(parts[3]) == 1
+                except Exception as e:
+                    print(f"[ERROR] Error handling reward: {e}")
+                    self.send_ack()
+                    continue
+            
+            else:
+                print(f"[WARNING] Unknown message type: {msg_type}")
+        
+        return None
+    
+    def send_action(self, action):
+        self.socket.sendall(f"ACTION|{action}\n".encode('utf-8'))
+    
+    def send_ack(self):
+        self.socket.sendall(b"ACK\n")
+
+
 class QServer:
     def __init__(self, host='localhost', port=5555):
         self.host = host
         self.port = port
         self.server_socket = None
+        self.selector = None
+        self.connections = {}
         
         # Initialize Q-Network agent
         self.agent = QNetworkAgent(
-            state_size=28,  # 4 (position + goal) + 24 (proximity sensors)
+            state_size=STATE_SIZE,
             action_size=4,   # forward, left, right, stop
             learning_rate=0.001,
             gamma=0.99,
             epsilon=1.0,
             epsilon_min=0.01,
-            epsilon_decay=0.995
+            epsilon_decay=0.995,
+            num_robots=NUM_ROBOTS
         )
         
         # Episode tracking
         self.episode_count = 0
-        self.episode_rewards = {i: 0.0 for i in range(4)}  # 4 robots
-        self.episode_steps = {i: 0 for i in range(4)}
+        self.episode_rewards = {i: 0.0 for i in range(NUM_ROBOTS)}
+        self.episode_steps = {i: 0 for i in range(NUM_ROBOTS)}
         
         # Training statistics
         self.total_steps = 0
         self.training_interval = 10  # Train every N steps
         
+        # Training schedule once exploration has finished: double the
+        # interval every anneal period, or jump to the maximum once the
+        # loss has plateaued below the threshold (EMA of training losses)
+        self.max_training_interval = 200
+        self.interval_anneal_steps = 10000
+        self.loss_ema = None
+        self.loss_ema_decay = 0.99
+        self.loss_plateau_threshold = 1e-3
+        
         # Model save directory
         self.model_dir = "../models"
         os.makedirs(self.model_dir, exist_ok=True)
         
         # Load existing model if available
         model_path = os.path.join(self.model_dir, "q_network_latest.pth")
-        self.agent.load_model(model_path)
+        try:
+            self.agent.load_model(model_path)
+        except ValueError as e:
+            print(f"[ERROR] {e}")
+            print("[ERROR] Match the agent settings or move the checkpoint aside")
+            raise SystemExit(1)
         
     def start(self):
         """Start the server"""
@@ -60,6 +266,12 @@ class QServer:
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.host, self.port))
         self.server_socket.listen(5)
+        self.server_socket.setblocking(False)
+        
+        # Single-threaded event loop over all robot connections
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server_socket, selectors.EVENT_READ, self.accept_client)
+        self.connections = {}
         
         print("=" * 50)
         print("=== Q-Learning Server Started ===")
@@ -69,120 +281,191 @@ class QServer:
         
         try:
             while True:
-                client_socket, address = self.server_socket.accept()
-                print(f"[INFO] Connection from {address}")
+                # Timeout keeps Ctrl+C responsive on Windows
+                for key, _ in self.selector.select(timeout=1.0):
+                    callback = key.data
+                    callback(key.fileobj)
                 
-                # Handle client in a new thread
-                client_thread = threading.Thread(
-                    target=self.handle_client,
-                    args=(client_socket,)
-                )
-                client_thread.start()
+                self.process_pending()
         
         except KeyboardInterrupt:
             print("\n[INFO] Server shutting down...")
             self.save_final_model()
         
         finally:
+            for client_socket in list(self.connections):
+                self.close_client(client_socket)
+            self.selector.close()
             if self.server_socket:
                 self.server_socket.close()
     
-    def handle_client(self, client_socket):
-        """Handle communication with a single robot controller"""
-        try:
-            while True:
-                # Receive message
-                data = client_socket.recv(4096).decode('utf-8').strip()
-                
-                if not data:
-                    break
-                
-                # Parse and handle message
-                response = self.process_message(data)
-                
-                # Send response
-                if response:
-                    client_socket.send((response + "\n").encode('utf-8'))
+    def accept_client(self, server_socket):
+        """Accept a new robot controller connection"""
+        client_socket, address = server_socket.accept()
+        client_socket.setblocking(True)
+        print(f"[INFO] Connection from {address}")
         
-        except Exception as e:
+        self.selector.register(client_socket, selectors.EVENT_READ, self.detect_protocol)
+    
+    def detect_protocol(self, client_socket):
+        """Pick the protocol from the first byte without consuming it"""
+        try:
+            first = client_socket.recv(1, socket.MSG_PEEK)
+        except OSError as e:
             print(f"[ERROR] Client handler error: {e}")
+            first = b""
         
-        finally:
+        if not first:
+            self.selector.unregister(client_socket)
             client_socket.close()
-    
-    def process_message(self, message):
-        """Process incoming message and return response"""
-        parts = message.split('|')
+            return
         
-        if not parts:
-            return None
-        
-        msg_type = parts[0]
-        
-        if msg_type == "STATE":
-            return self.handle_state(parts)
+        if first[0] in (MSG_STATE, MSG_REWARD):
+            self.connections[client_socket] = BinaryConnection(client_socket)
+        else:
+            self.connections[client_socket] = TextConnection(client_socket)
         
-        elif msg_type == "REWARD":
-            return self.handle_reward(parts)
+        self.selector.modify(client_socket, selectors.EVENT_READ, self.receive_client)
+        self.receive_client(client_socket)
+    
+    def receive_client(self, client_socket):
+        """Receive data from a robot controller"""
+        try:
+            if not self.connections[client_socket].receive():
+                self.close_client(client_socket)
         
-        else:
-            print(f"[WARNING] Unknown message type: {msg_type}")
-            return None
+        except Exception as e:
+            print(f"[ERROR] Client handler error: {e}")
+            self.close_client(client_socket)
+    
+    def close_client(self, client_socket):
+        """Unregister and close a robot controller connection"""
+        self.connections.pop(client_socket, None)
+        self.selector.unregister(client_socket)
+        client_socket.close()
     
-    def handle_state(self, parts):
+    def process_pending(self):
         """
-        Handle STATE message
-        Format: STATE|robot_id|x|y|goal_x|goal_y|prox0|...|prox23
-        Returns: ACTION|action_id
+        Handle all complete messages received from every robot
+        
+        STATE messages from all connections are answered with a single
+        batched forward pass. Each connection is only parsed up to the
+        first non-STATE message following one of its STATEs, so every
+        robot's messages are still handled in order.
         """
-        try:
-            robot_id = int(parts[1])
-            state_values = [float(x) for x in parts[2:]]
+        while True:
+            batch = []
             
-            # Verify state size
-            if len(state_values) != 28:
-                print(f"[WARNING] Invalid state size: {len(state_values)} (expected 28)")
-                return "ACTION|0"  # Default: move forward
+            for connection in list(self.connections.values()):
+                has_state = False
+                try:
+                    while True:
+                        message = connection.next_message(states_only=has_state)
+                        
+                        if message is None:
+                            break
+                        
+                        if message[0] == MSG_STATE:
+                            batch.append((connection, message[1], message[2]))
+                            has_state = True
+                        else:
+                            _, robot_id, reward, done = message
+                            self.record_reward(robot_id, reward, done)
+                            connection.send_ack()
+                
+                except Exception as e:
+                    print(f"[ERROR] Client handler error: {e}")
+                    self.close_client(connection.socket)
             
-            # Select action using Q-Network
-            action = self.agent.select_action(state_values, robot_id)
+            if not batch:
+                return
             
-            # Increment step counter
-            self.total_steps += 1
-            self.episode_steps[robot_id] += 1
+            connections, robot_ids, states = zip(*batch)
+            actions = self.select_actions(list(robot_ids), np.stack(states))
             
-            # Train periodically
-            if self.total_steps % self.training_interval == 0:
-                loss = self.agent.train()
-                if loss is not None and self.total_steps % 100 == 0:
-                    stats = self.agent.get_statistics()
-                    print(f"[TRAIN] Step {self.total_steps} | "
-                          f"Loss: {loss:.4f} | "
-                          f"Epsilon: {stats['epsilon']:.4f} | "
-                          f"Buffer: {stats['buffer_size']}")
+            for connection, action in zip(connections, actions):
+                try:
+                    connection.send_action(action)
+                except Exception as e:
+                    print(f"[ERROR] Client handler error: {e}")
+                    if connection.socket in self.connections:
+                        self.close_client(connection.socket)
+    
+    def select_actions(self, robot_ids, states):
+        """
+        Select actions for a batch of robots and advance step counters
+        
+        Args:
+            robot_ids: IDs of the robots, one per state
+            states: Array of state vectors, shape (n, 28)
             
-            return f"ACTION|{action}"
+        Returns:
+            actions: List of selected actions (0 on error)
+        """
+        actions = [0] * len(robot_ids)  # Default: move forward
+        
+        try:
+            # Select actions using Q-Network
+            actions = [int(a) for a in self.agent.select_actions_batch(states, robot_ids)]
+            
+            for robot_id in robot_ids:
+                # Increment step counter
+                self.total_steps += 1
+                self.episode_steps[robot_id] += 1
+                
+                # Train periodically
+                if self.total_steps % self.training_interval == 0:
+                    self.train_step()
+                
+                # Train less often once learning has converged
+                if self.total_steps % self.interval_anneal_steps == 0:
+                    self.anneal_training_interval()
         
         except Exception as e:
             print(f"[ERROR] Error handling state: {e}")
-            return "ACTION|0"
+        
+        return actions
     
-    def handle_reward(self, parts):
-        """
-        Handle REWARD message
-        Format: REWARD|robot_id|reward|done
-        Returns: ACK
-        """
+    def train_step(self):
+        """Run one training update and log progress periodically"""
+        loss = self.agent.train()
+        
+        if loss is not None:
+            if self.loss_ema is None:
+                self.loss_ema = loss
+            else:
+                self.loss_ema = (self.loss_ema_decay * self.loss_ema
+                                 + (1 - self.loss_ema_decay) * loss)
+        
+        if loss is not None and self.total_steps % 100 == 0:
+            stats = self.agent.get_statistics()
+            print(f"[TRAIN] Step {self.total_steps} | "
+                  f"Loss: {loss:.4f} | "
+                  f"Epsilon: {stats['epsilon']:.4f} | "
+                  f"Buffer: {stats['buffer_size']}")
+    
+    def anneal_training_interval(self):
+        """Lengthen the training interval once epsilon has reached its minimum"""
+        if self.agent.epsilon > self.agent.epsilon_min * 1.01:
+            return
+        
+        if self.loss_ema is not None and self.loss_ema < self.loss_plateau_threshold:
+            interval = self.max_training_interval
+        else:
+            interval = min(self.max_training_interval, self.training_interval * 2)
+        
+        if interval != self.training_interval:
+            self.training_interval = interval
+            print(f"[TRAIN] Step {self.total_steps} | "
+                  f"Training interval: {self.training_interval} steps")
+    
+    def record_reward(self, robot_id, reward, done):
+        """Store a reward transition and update episode tracking"""
         try:
-            robot_id = int(parts[1])
-            reward = float(parts[2])
-            done = int(parts[3]) == 1
-            
             # Get next state (will be provided in next STATE message)
             # For now, use current state as placeholder
-            if robot_id in self.agent.current_states:
-                next_state = self.agent.current_states[robot_id]
-                self.agent.store_transition(robot_id, reward, next_state, done)
+            next_state = self.agent.current_states[robot_id]
+            self.agent.store_transition(robot_id, reward, next_state, done)
             
             # Update episode reward
             self.episode_rewards[robot_id] += reward
@@ -210,21 +493,21 @@ class QServer:
                 # Print statistics every 100 episodes
                 if self.episode_count % 100 == 0:
                     self.print_statistics()
-            
-            return "ACK"
         
         except Exception as e:
             print(f"[ERROR] Error handling reward: {e}")
-            return "ACK"
     
     def save_model(self):
         """Save the current model"""
         filepath = os.path.join(self.model_dir, f"q_network_episode_{self.episode_count}.pth")
         self.agent.save_model(filepath)
         
-        # Also save as latest
+        # Also save as latest (copy the file instead of serializing again;
+        # copy then rename so a crash never leaves a truncated latest)
         latest_path = os.path.join(self.model_dir, "q_network_latest.pth")
-        self.agent.save_model(latest_path)
+        tmp_path = latest_path + ".tmp"
+        shutil.copyfile(filepath, tmp_path)
+        os.replace(tmp_path, latest_path)
     
     def save_final_model(self):
         """Save the final model and statistics"""
@@ -248,6 +531,18 @@ class QServer:
         with open(filepath, 'w') as f:
             json.dump(curve_data, f, indent=2)
         
+        # Binary copy of the rewards so analysis tools can memory-map them
+        rewards_path = os.path.splitext(filepath)[0] + "_rewards.npy"
+        np.save(rewards_path, np.asarray(self.agent.episode_rewards, dtype=np.float32))
+        
+        # Run metadata, so tools reading the sidecar never parse the full JSON
+        meta_path = os.path.splitext(filepath)[0] + "_meta.json"
+        with open(meta_path, 'w') as f:
+            json.dump({
+                'total_episodes': self.episode_count,
+                'final_epsilon': self.agent.epsilon
+            }, f, indent=2)
+        
         print(f"[INFO] Training data saved to {filepath}")
     
     def print_statistics(self):
@@ -260,6 +555,7 @@ class QServer:
         print(f"Total Steps: {self.total_steps}")
         print(f"Epsilon: {stats['epsilon']:.4f}")
         print(f"Buffer Size: {stats['buffer_size']}")
+        print(f"Training Interval: {self.training_interval}")
         print(f"Avg Reward (last 100): {stats['avg_reward_last_100']:.2f}")
         print(f"Total Episodes: {stats['total_episodes']}")
         print("=" * 60 + "\n")
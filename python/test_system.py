@@ -112,10 +112,147 @@ def test_socket_server():
     return True
 
 
+def test_server_protocol():
+    """Test a loopback round trip through the server (binary and text)"""
+    print("=" * 60)
+    print("TEST 4: Testing Server Protocol")
+    print("=" * 60)
+    
+    try:
+        import socket
+        import struct
+        import threading
+        import time
+        import numpy as np
+        from q_server import QServer, STATE_FRAME, REWARD_FRAME, MSG_STATE, MSG_REWARD
+        
+        def recv_exact(sock, size):
+            data = b""
+            while len(data) < size:
+                chunk = sock.recv(size - len(data))
+                if not chunk:
+                    raise ConnectionError("server closed the connection")
+                data += chunk
+            return data
+        
+        # Run the server in the background on a spare port
+        port = 5556
+        server = QServer(port=port)
+        threading.Thread(target=server.start, daemon=True).start()
+        
+        binary_client = None
+        for _ in range(50):
+            try:
+                binary_client = socket.create_connection(('localhost', port), timeout=30)
+                break
+            except ConnectionRefusedError:
+                time.sleep(0.1)
+        if binary_client is None:
+            raise ConnectionError("server did not start listening")
+        
+        # Binary STATE split across two sends -> 2-byte ACTION
+        state = np.random.rand(28).astype(np.float32)
+        frame = STATE_FRAME.pack(MSG_STATE, 0, *state)
+        binary_client.sendall(frame[:50])
+        time.sleep(0.1)
+        binary_client.sendall(frame[50:])
+        msg_type, action = struct.unpack('<BB', recv_exact(binary_client, 2))
+        if msg_type != 0x03 or not 0 <= action < 4:
+            raise ValueError(f"unexpected ACTION frame: {msg_type:#x} {action}")
+        print(f"✓ Binary STATE (split frame) -> ACTION {action}")
+        
+        # Binary REWARD -> ACK
+        binary_client.sendall(REWARD_FRAME.pack(MSG_REWARD, 0, 1.0, 0))
+        if recv_exact(binary_client, 1) != b"\x04":
+            raise ValueError("unexpected ACK frame")
+        print("✓ Binary REWARD -> ACK")
+        binary_client.close()
+        
+        # Legacy text STATE/REWARD
+        text_client = socket.create_connection(('localhost', port), timeout=30)
+        values = "|".join(f"{v:.4f}" for v in np.random.rand(28))
+        text_client.sendall(f"STATE|1|{values}\n".encode('utf-8'))
+        reply = text_client.makefile('r')
+        action_line = reply.readline().strip()
+        if not action_line.startswith("ACTION|"):
+            raise ValueError(f"unexpected text reply: {action_line!r}")
+        print(f"✓ Text STATE -> {action_line}")
+        
+        text_client.sendall(b"REWARD|1|0.5|0\n")
+        ack_line = reply.readline().strip()
+        if ack_line != "ACK":
+            raise ValueError(f"unexpected text reply: {ack_line!r}")
+        print("✓ Text REWARD -> ACK")
+        text_client.close()
+        
+    except Exception as e:
+        print(f"✗ Server protocol test failed: {e}")
+        return False
+    
+    print("")
+    return True
+
+
+def test_analysis_helpers():
+    """Test the moving average and median helpers against plain NumPy"""
+    print("=" * 60)
+    print("TEST 5: Testing Analysis Helpers")
+    print("=" * 60)
+    
+    try:
+        import numpy as np
+        import visualize
+        
+        def baseline_moving_average(rewards, window=50):
+            return [np.mean(rewards[max(0, i - window + 1):i + 1]) for i in range(len(rewards))]
+        
+        def check_moving_average(backend):
+            for n in (0, 1, 49, 50, 51, 1000):
+                rewards = np.random.randn(n).astype(np.float32)
+                result = visualize._moving_average(rewards)
+                expected = baseline_moving_average(rewards.astype(np.float64))
+                if len(result) != n or not np.allclose(result, expected, atol=1e-6):
+                    raise ValueError(f"{backend} moving average differs for n={n}")
+            print(f"✓ Moving average matches baseline ({backend})")
+        
+        saved = (visualize.uniform_filter1d, visualize.PARALLEL_MOVING_AVERAGE_MIN,
+                 visualize.CHUNK_SIZE)
+        try:
+            check_moving_average("scipy" if visualize.uniform_filter1d else "cumsum")
+            
+            # Cumulative-sum fallback, with blocks small enough to split the run
+            visualize.uniform_filter1d = None
+            visualize.CHUNK_SIZE = 7
+            check_moving_average("cumsum")
+            
+            # Parallel numba kernel (normally only used for 1M+ episodes)
+            if visualize._rolling_mean_kernel() is not None:
+                visualize.PARALLEL_MOVING_AVERAGE_MIN = 1
+                check_moving_average("numba")
+            else:
+                print("⚠ numba not installed, skipping parallel moving average")
+        finally:
+            (visualize.uniform_filter1d, visualize.PARALLEL_MOVING_AVERAGE_MIN,
+             visualize.CHUNK_SIZE) = saved
+        
+        for n in (1, 2, 3, 4, 101, 1000):
+            rewards = np.random.randn(n).astype(np.float32)
+            if not np.isclose(visualize._fast_median(rewards), np.median(rewards.astype(np.float64))):
+                raise ValueError(f"median differs for n={n}")
+        print("✓ Median matches np.median (odd and even lengths)")
+        
+    except Exception as e:
+        print(f"✗ Analysis helper test failed: {e}")
+        return False
+    
+    print("")
+    return True
+
+
 def test_file_structure():
     """Test if all required files exist"""
     print("=" * 60)
-    print("TEST 4: Checking File Structure")
+    print("TEST 6: Checking File Structure")
     print("=" * 60)
     
     required_files = [
@@ -162,7 +299,7 @@ def test_file_structure():
 def test_argos_installation():
     """Test if ARGoS is installed"""
     print("=" * 60)
-    print("TEST 5: Checking ARGoS Installation")
+    print("TEST 7: Checking ARGoS Installation")
     print("=" * 60)
     
     import subprocess
@@ -201,6 +338,8 @@ def run_all_tests():
     results.append(("Python Imports", test_imports()))
     results.append(("Q-Network", test_q_network()))
     results.append(("Socket Server", test_socket_server()))
+    results.append(("Server Protocol", test_server_protocol()))
+    results.append(("Analysis Helpers", test_analysis_helpers()))
     results.append(("File Structure", test_file_structure()))
     results.append(("ARGoS Installation", test_argos_installation()))
     
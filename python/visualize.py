@@ -5,61 +5,332 @@ This script provides tools to visualize training progress
 and analyze the learned Q-Network behavior.
 """
 
+import functools
 import json
-import matplotlib.pyplot as plt
+from concurrent.futures import ThreadPoolExecutor
+import matplotlib
 import numpy as np
 import os
+import sys
+
+# Render off-screen when there is no X/Wayland display to show figures on
+if (sys.platform.startswith('linux') and not os.environ.get('DISPLAY')
+        and not os.environ.get('WAYLAND_DISPLAY')):
+    matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+try:
+    from scipy.ndimage import uniform_filter1d
+except ImportError:
+    uniform_filter1d = None
+
+# Episodes per moving-average window in training plots
+MOVING_AVERAGE_WINDOW = 50
+
+# Runs at least this long use the parallel numba moving average
+PARALLEL_MOVING_AVERAGE_MIN = 1_000_000
+
+# Elements per block when streaming over (possibly memory-mapped) rewards
+CHUNK_SIZE = 1 << 18
+
+
+@functools.lru_cache(maxsize=8)
+def _load(path, mtime):
+    """Parse a training data file (cached per path and modification time)"""
+    with open(path, 'rb') as f:
+        data = _loads(f.read())
+    
+    rewards = np.asarray(data['episode_rewards'], dtype=np.float32)
+    rewards.flags.writeable = False
+    data['episode_rewards'] = rewards
+    return data
+
+
+def _load_training(path):
+    """Load training data, reusing the parsed result if the file is unchanged"""
+    path = os.path.abspath(path)
+    return _load(path, os.path.getmtime(path))
+
+
+@functools.lru_cache(maxsize=None)
+def _rolling_mean_kernel():
+    """Compile the parallel moving-average kernel on first use (None without numba)"""
+    try:
+        from numba import njit, prange
+    except ImportError:
+        return None
+    
+    @njit(parallel=True, cache=True, fastmath=True)
+    def _rolling_mean_nb(a, w, out):
+        """Sliding-window moving average, one independent chunk per thread"""
+        n = a.shape[0]
+        chunk = 65536
+        for c in prange((n + chunk - 1) // chunk):
+            start = c * chunk
+            stop = min(start + chunk, n)
+            
+            # Seed the window sum with the values preceding this chunk
+            s = 0.0
+            for j in range(max(0, start - w), start):
+                s += a[j]
+            for i in range(start, stop):
+                s += a[i]
+                if i >= w:
+                    s -= a[i - w]
+                out[i] = s / min(i + 1, w)
+    
+    return _rolling_mean_nb
+
+
+def _summary_stats(rewards):
+    """Return (mean, std, min, max) of the rewards"""
+    return np.mean(rewards), np.std(rewards), np.min(rewards), np.max(rewards)
+
+
+def _fast_median(a):
+    """Median via quickselect (O(n) on average, no full sort)"""
+    n = len(a)
+    k = n // 2
+    p = np.partition(a, k)
+    if n & 1:
+        return float(p[k])
+    return 0.5 * (float(p[k]) + float(p[:k].max()))
+
+
+def _sidecar(path, suffix):
+    """Sidecar file of a training data file, or None if missing or stale"""
+    sidecar = os.path.splitext(path)[0] + suffix
+    if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(path):
+        return sidecar
+    return None
+
+
+def _load_rewards(path):
+    """
+    Load episode rewards, preferring the memory-mapped .npy sidecar
+    written next to the JSON file by the training server
+    """
+    sidecar = _sidecar(path, '_rewards.npy')
+    if sidecar is not None:
+        return np.load(sidecar, mmap_mode='r')
+    return _load_training(path)['episode_rewards']
+
+
+def _load_metadata(path):
+    """
+    Load total_episodes and final_epsilon, preferring the small metadata
+    sidecar so the full JSON is only parsed when there is no sidecar
+    """
+    sidecar = _sidecar(path, '_meta.json')
+    if sidecar is not None:
+        with open(sidecar, 'rb') as f:
+            return _loads(f.read())
+    
+    data = _load_training(path)
+    return {'total_episodes': data['total_episodes'],
+            'final_epsilon': data['final_epsilon']}
+
+
+def _chunked_cumsum(a):
+    """float64 running sum computed one cache-sized block at a time"""
+    n = len(a)
+    out = np.empty(n, dtype=np.float64)
+    carry = 0.0
+    for lo in range(0, n, CHUNK_SIZE):
+        hi = min(lo + CHUNK_SIZE, n)
+        np.cumsum(a[lo:hi], dtype=np.float64, out=out[lo:hi])
+        out[lo:hi] += carry
+        carry = out[hi - 1]
+    return out
+
+
+def _moving_average(rewards, window=MOVING_AVERAGE_WINDOW):
+    """Moving average over the last `window` rewards (expanding mean at the start)"""
+    # float32 halves the bytes streamed; sums still accumulate in float64
+    x = np.asarray(rewards, dtype=np.float32)
+    w = window
+    
+    # Short runs never fill a window: the result is just the expanding mean
+    if len(x) <= w:
+        return np.cumsum(x, dtype=np.float64) / np.arange(1, len(x) + 1)
+    
+    if len(x) >= PARALLEL_MOVING_AVERAGE_MIN and _rolling_mean_kernel() is not None:
+        out = np.empty(len(x), dtype=np.float64)
+        _rolling_mean_kernel()(x, w, out)
+        return out
+    
+    head = np.cumsum(x[:w], dtype=np.float64) / np.arange(1, w + 1)
+    
+    if uniform_filter1d is not None:
+        # Trailing boxcar in one C pass, then patch the expanding left edge
+        out = uniform_filter1d(x, size=w, mode='nearest', origin=(w - 1) // 2,
+                               output=np.float64)
+        out[:w] = head
+        return out
+    
+    # Turn the running sum into window means in place, walking backwards
+    # so every block still reads unmodified sums from below it
+    out = _chunked_cumsum(x)
+    for hi in range(len(x), w, -CHUNK_SIZE):
+        lo = max(w, hi - CHUNK_SIZE)
+        out[lo:hi] = (out[lo:hi] - out[lo - w:hi - w]) / w
+    out[:w] = head
+    return out
+
+
+def _decimate(y, target=2400):
+    """
+    Min/max decimate a series to about `target` points for plotting
+    
+    Returns:
+        Tuple (x, y) of the kept episode indices and their values
+    """
+    n = len(y)
+    if n <= target:
+        return np.arange(n), y
+    
+    # Keep the extremes of each bucket so spikes stay visible
+    bucket = -(-n // (target // 2))
+    m = n // bucket
+    blocks = np.asarray(y[:m * bucket]).reshape(m, bucket)
+    idx = np.sort(np.stack((blocks.argmin(axis=1), blocks.argmax(axis=1)), axis=1), axis=1)
+    idx = (idx + np.arange(0, m * bucket, bucket)[:, None]).ravel()
+    idx = np.concatenate((idx, np.arange(m * bucket, n)))
+    return idx, y[idx]
+
+
+def _maybe_show(fig, show=True):
+    """Show a figure on interactive backends, then release it"""
+    if show and matplotlib.get_backend().lower() != 'agg':
+        plt.show()
+    plt.close(fig)
+
+
+def _summary_path(path):
+    """Path of the precomputed summary stored next to a training data file"""
+    return os.path.splitext(path)[0] + '_summary.npz'
+
+
+def _compute_summary(path):
+    """Compute the plot arrays and statistics for one training run"""
+    metadata = _load_metadata(path)
+    rewards = _load_rewards(path)
+    n = len(rewards)
+    
+    raw_x, raw_y = _decimate(rewards)
+    counts, edges = np.histogram(rewards, bins=50)
+    summary = {
+        'window': MOVING_AVERAGE_WINDOW,
+        'episodes': n,
+        'final_epsilon': metadata['final_epsilon'],
+        'moving_avg': _moving_average(rewards).astype(np.float32),
+        'raw_x': raw_x,
+        'raw_y': np.asarray(raw_y, dtype=np.float32),
+        'hist_counts': counts,
+        'hist_edges': edges,
+    }
+    
+    if n == 0:
+        return summary
+    
+    # Head/tail windows shrink to the run length for runs under 100 episodes
+    k = min(100, n)
+    mean, std, min_reward, max_reward = _summary_stats(rewards)
+    
+    # Head/tail stats read only their own k elements (views, no copies)
+    first, last = rewards[:k], rewards[-k:]
+    
+    summary.update({
+        'mean': mean,
+        'std': std,
+        'min': min_reward,
+        'max': max_reward,
+        'median': _fast_median(rewards),
+        'first_mean': np.mean(first, dtype=np.float64),
+        'first_max': np.max(first),
+        'last_mean': np.mean(last, dtype=np.float64),
+        'last_max': np.max(last),
+    })
+    return summary
 
 
-def plot_training_curve(data_file="../models/training_data.json"):
+def _ensure_summary(path):
+    """
+    Load the precomputed summary of a training run, rebuilding it
+    when it is missing or older than the data it was computed from
+    """
+    summary_file = _summary_path(path)
+    stem = os.path.splitext(path)[0]
+    sidecars = [stem + '_rewards.npy', stem + '_meta.json']
+    sources = [path] + [sidecar for sidecar in sidecars if os.path.exists(sidecar)]
+    
+    try:
+        if os.path.getmtime(summary_file) >= max(map(os.path.getmtime, sources)):
+            with np.load(summary_file) as npz:
+                if npz['window'] == MOVING_AVERAGE_WINDOW:
+                    return {key: npz[key] for key in npz.files}
+    except (OSError, ValueError, KeyError):
+        pass
+    
+    summary = _compute_summary(path)
+    
+    try:
+        tmp_file = summary_file + ".tmp"
+        with open(tmp_file, 'wb') as f:
+            np.savez_compressed(f, **summary)
+        os.replace(tmp_file, summary_file)
+    except OSError as e:
+        print(f"Warning: could not write {summary_file}: {e}")
+    
+    return summary
+
+
+def plot_training_curve(data_file="../models/training_data.json", show=True):
     """Plot the training reward curve"""
     
     if not os.path.exists(data_file):
         print(f"Error: {data_file} not found. Run training first.")
         return
     
-    # Load training data
-    with open(data_file, 'r') as f:
-        data = json.load(f)
-    
-    episode_rewards = data['episode_rewards']
-    
-    # Calculate moving average
-    window_size = 50
-    moving_avg = []
-    for i in range(len(episode_rewards)):
-        start_idx = max(0, i - window_size + 1)
-        moving_avg.append(np.mean(episode_rewards[start_idx:i+1]))
+    # Load precomputed curves (rebuilt if the training data changed)
+    summary = _ensure_summary(data_file)
+    window_size = int(summary['window'])
     
     # Create plot
-    plt.figure(figsize=(12, 6))
+    fig, axes = plt.subplots(1, 2, figsize=(12, 6), constrained_layout=True)
     
     # Plot raw rewards
-    plt.subplot(1, 2, 1)
-    plt.plot(episode_rewards, alpha=0.3, label='Episode Reward')
-    plt.plot(moving_avg, label=f'Moving Average ({window_size} episodes)', linewidth=2)
-    plt.xlabel('Episode')
-    plt.ylabel('Total Reward')
-    plt.title('Training Progress')
-    plt.legend()
-    plt.grid(True, alpha=0.3)
+    ax = axes[0]
+    ax.plot(summary['raw_x'], summary['raw_y'], alpha=0.3, label='Episode Reward', rasterized=True)
+    ax.plot(summary['moving_avg'], label=f'Moving Average ({window_size} episodes)', linewidth=2)
+    ax.set_xlabel('Episode')
+    ax.set_ylabel('Total Reward')
+    ax.set_title('Training Progress')
+    ax.legend()
+    ax.grid(True, alpha=0.3)
     
     # Plot reward distribution
-    plt.subplot(1, 2, 2)
-    plt.hist(episode_rewards, bins=50, edgecolor='black', alpha=0.7)
-    plt.xlabel('Episode Reward')
-    plt.ylabel('Frequency')
-    plt.title('Reward Distribution')
-    plt.grid(True, alpha=0.3)
-    
-    plt.tight_layout()
+    ax = axes[1]
+    ax.stairs(summary['hist_counts'], summary['hist_edges'],
+              fill=True, edgecolor='black', linewidth=1, alpha=0.7)
+    ax.set_xlabel('Episode Reward')
+    ax.set_ylabel('Frequency')
+    ax.set_title('Reward Distribution')
+    ax.grid(True, alpha=0.3)
     
     # Save plot
     output_file = "../models/training_curve.png"
-    plt.savefig(output_file, dpi=150)
+    fig.savefig(output_file, dpi=150)
     print(f"Plot saved to {output_file}")
     
-    plt.show()
+    _maybe_show(fig, show)
 
 
 def analyze_statistics(data_file="../models/training_data.json"):
@@ -69,29 +340,30 @@ def analyze_statistics(data_file="../models/training_data.json"):
         print(f"Error: {data_file} not found. Run training first.")
         return
     
-    with open(data_file, 'r') as f:
-        data = json.load(f)
+    summary = _ensure_summary(data_file)
     
-    rewards = np.array(data['episode_rewards'])
+    if summary['episodes'] == 0:
+        print("No episodes recorded yet.")
+        return
     
     print("\n" + "=" * 60)
     print("TRAINING ANALYSIS")
     print("=" * 60)
-    print(f"Total Episodes: {len(rewards)}")
-    print(f"Final Epsilon: {data['final_epsilon']:.4f}")
+    print(f"Total Episodes: {summary['episodes']}")
+    print(f"Final Epsilon: {summary['final_epsilon']:.4f}")
     print(f"\nReward Statistics:")
-    print(f"  Mean: {np.mean(rewards):.2f}")
-    print(f"  Std Dev: {np.std(rewards):.2f}")
-    print(f"  Min: {np.min(rewards):.2f}")
-    print(f"  Max: {np.max(rewards):.2f}")
-    print(f"  Median: {np.median(rewards):.2f}")
+    print(f"  Mean: {summary['mean']:.2f}")
+    print(f"  Std Dev: {summary['std']:.2f}")
+    print(f"  Min: {summary['min']:.2f}")
+    print(f"  Max: {summary['max']:.2f}")
+    print(f"  Median: {summary['median']:.2f}")
     print(f"\nLast 100 Episodes:")
-    print(f"  Mean: {np.mean(rewards[-100:]):.2f}")
-    print(f"  Max: {np.max(rewards[-100:]):.2f}")
+    print(f"  Mean: {summary['last_mean']:.2f}")
+    print(f"  Max: {summary['last_max']:.2f}")
     print(f"\nFirst 100 Episodes:")
-    print(f"  Mean: {np.mean(rewards[:100]):.2f}")
-    print(f"  Max: {np.max(rewards[:100]):.2f}")
-    print(f"\nImprovement: {np.mean(rewards[-100:]) - np.mean(rewards[:100]):.2f}")
+    print(f"  Mean: {summary['first_mean']:.2f}")
+    print(f"  Max: {summary['first_max']:.2f}")
+    print(f"\nImprovement: {summary['last_mean'] - summary['first_mean']:.2f}")
     print("=" * 60 + "\n")
 
 
@@ -102,10 +374,10 @@ def test_trained_model(model_file="../models/q_network_final.pth"):
         print(f"Error: {model_file} not found. Train a model first.")
         return
     
-    from q_network import QNetworkAgent
+    from q_network import QNetworkAgent, checkpoint_options
     
-    # Load trained agent
-    agent = QNetworkAgent()
+    # Load trained agent, built with the options the checkpoint was saved with
+    agent = QNetworkAgent(**checkpoint_options(model_file))
     agent.load_model(model_file)
     agent.epsilon = 0.0  # No exploration, pure exploitation
     
@@ -118,59 +390,61 @@ def test_trained_model(model_file="../models/q_network_final.pth"):
     print("=" * 60 + "\n")
 
 
-def compare_training_runs(*data_files):
+def compare_training_runs(*data_files, show=True):
     """Compare multiple training runs"""
     
-    plt.figure(figsize=(12, 6))
-    
-    for i, data_file in enumerate(data_files):
-        if not os.path.exists(data_file):
+    found = []
+    for data_file in data_files:
+        if os.path.exists(data_file):
+            found.append(data_file)
+        else:
             print(f"Warning: {data_file} not found, skipping...")
-            continue
-        
-        with open(data_file, 'r') as f:
-            data = json.load(f)
-        
-        rewards = data['episode_rewards']
-        
-        # Calculate moving average
-        window_size = 50
-        moving_avg = []
-        for j in range(len(rewards)):
-            start_idx = max(0, j - window_size + 1)
-            moving_avg.append(np.mean(rewards[start_idx:j+1]))
-        
+    
+    # Load runs concurrently. Smoothing stays on this thread because the
+    # parallel numba kernel must not be launched from worker threads
+    runs = []
+    if found:
+        with ThreadPoolExecutor(max_workers=min(8, len(found))) as executor:
+            runs = list(executor.map(_load_rewards, found))
+    
+    fig, ax = plt.subplots(figsize=(10, 5))
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    
+    for data_file, rewards in zip(found, runs):
         label = os.path.basename(data_file)
-        plt.plot(moving_avg, label=label, linewidth=2)
+        ax.plot(_moving_average(rewards), label=label, linewidth=2)
     
-    plt.xlabel('Episode')
-    plt.ylabel('Average Reward')
-    plt.title('Training Comparison')
-    plt.legend()
-    plt.grid(True, alpha=0.3)
+    ax.set_xlabel('Episode')
+    ax.set_ylabel('Average Reward')
+    ax.set_title('Training Comparison')
+    ax.legend()
+    ax.grid(True, alpha=0.3)
     
     output_file = "../models/training_comparison.png"
-    plt.savefig(output_file, dpi=150)
+    fig.savefig(output_file, dpi=100)
     print(f"Comparison plot saved to {output_file}")
     
-    plt.show()
+    _maybe_show(fig, show)
 
 
 if __name__ == "__main__":
-    import sys
-    
     print("\n=== Q-Learning Visualization Tools ===\n")
     
-    if len(sys.argv) > 1:
-        if sys.argv[1] == "plot":
-            plot_training_curve()
-        elif sys.argv[1] == "stats":
+    # --no-show saves plots without opening a window (for SSH/CI)
+    show = "--no-show" not in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != "--no-show"]
+    
+    if len(args) > 0:
+        if args[0] == "plot":
+            plot_training_curve(show=show)
+        elif args[0] == "stats":
             analyze_statistics()
-        elif sys.argv[1] == "test":
+        elif args[0] == "test":
             test_trained_model()
-        elif sys.argv[1] == "compare":
-            if len(sys.argv) > 2:
-                compare_training_runs(*sys.argv[2:])
+        elif args[0] == "compare":
+            if len(args) > 1:
+                compare_training_runs(*args[1:], show=show)
             else:
                 print("Usage: python visualize.py compare <file1> <file2> ...")
         else:
@@ -181,5 +455,6 @@ if __name__ == "__main__":
         print("  python visualize.py stats    - Show statistics")
         print("  python visualize.py test     - Test trained model")
         print("  python visualize.py compare <files...> - Compare multiple runs")
+        print("\nAdd --no-show to save plots without displaying them")
         print("\nRunning default: plot")
-        plot_training_curve()
+        plot_training_curve(show=show)